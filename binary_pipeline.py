@@ -0,0 +1,232 @@
+import os
+import time
+import glob
+import argparse
+import numpy as np
+import pandas as pd
+
+from cleaning_pipeline import exercises_to_columns, extract_date_from_filename
+
+sensor_prefixes = ['right_hand', 'left_hand', 'right_leg', 'left_leg', 'ball']
+
+def field_type(series):
+    # Integer columns (index, battery) stay integers so the cleaned CSV matches
+    # process_file; anything with NaN or decimals is stored as float64
+    if pd.api.types.is_integer_dtype(series.dtype):
+        return '<i8'
+    return '<f8'
+
+def sensor_dtype(prefix, df):
+    # One block per sensor: right_leg_accel_x is stored as right_leg.accel_x
+    return np.dtype([
+        (col[len(prefix) + 1:], field_type(df[col]))
+        for col in df.columns if col.startswith(prefix)
+    ])
+
+def record_dtype(df):
+    descr = []
+    known = set()
+    for prefix in sensor_prefixes:
+        block = sensor_dtype(prefix, df)
+        if block.names:
+            descr.append((prefix, block))
+            known.update(f"{prefix}_{name}" for name in block.names)
+    descr.extend((col, field_type(df[col])) for col in df.columns if col not in known)
+    return np.dtype(descr)
+
+def record_columns(dtype):
+    # Flat CSV column names paired with the field path into the record
+    columns = []
+    for name in dtype.names:
+        if dtype[name].names:
+            columns.extend((f"{name}_{sub}", (name, sub)) for sub in dtype[name].names)
+        else:
+            columns.append((name, (name,)))
+    return columns
+
+def record_field(records, path):
+    for name in path:
+        records = records[name]
+    return records
+
+def binary_path_for(csv_path, output_dir):
+    return os.path.join(output_dir, os.path.splitext(os.path.basename(csv_path))[0] + '.npy')
+
+def convert_csv_to_binary(csv_path, output_dir):
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    output_path = binary_path_for(csv_path, output_dir)
+    if os.path.exists(output_path) and os.path.getmtime(output_path) >= os.path.getmtime(csv_path):
+        return output_path
+
+    if os.stat(csv_path).st_size == 0:
+        print(f"Skipping empty file: {csv_path}")
+        return None
+
+    df = pd.read_csv(csv_path)
+    dtype = record_dtype(df)
+    records = np.empty(len(df), dtype=dtype)
+    for col, path in record_columns(dtype):
+        values = df[col] if field_type(df[col]) == '<i8' else pd.to_numeric(df[col], errors='coerce')
+        record_field(records, path)[...] = values.to_numpy()
+
+    np.save(output_path, records)
+    print(f"Converted {csv_path} to {output_path}")
+    return output_path
+
+def load_binary(file_path):
+    return np.load(file_path, mmap_mode='r')
+
+def reorder_fields(records, file_name):
+    exercise_name = os.path.splitext(os.path.basename(file_name))[0].split('-')[0]
+
+    if exercise_name in exercises_to_columns:
+        prefixes = [sensor_prefixes[index-1] for index in exercises_to_columns[exercise_name]]
+    else:
+        prefixes = sensor_prefixes
+
+    blocks = [prefix for prefix in dict.fromkeys(prefixes) if prefix in records.dtype.names]
+    return records[blocks]
+
+def valid_row_mask(records):
+    mask = np.ones(len(records), dtype=bool)
+    for _, path in record_columns(records.dtype):
+        values = record_field(records, path)
+        mask &= (values > -1e10) & (values < 1e10)
+    return mask
+
+def find_valid_start_row(records, timestamp_paths, mask):
+    # Same rule as find_valid_start_index, evaluated on the rows kept by mask
+    start_indices = []
+    for path in timestamp_paths:
+        candidates = np.flatnonzero(record_field(records, path)[mask] < 1)
+        if len(candidates):
+            start_indices.append(candidates[0])
+
+    if not start_indices:
+        return None
+    return max(start_indices)
+
+def first_occurrence_mask(values):
+    _, first = np.unique(values, return_index=True)
+    mask = np.zeros(len(values), dtype=bool)
+    mask[first] = True
+    return mask
+
+def clean_records(records, file_path):
+    records = reorder_fields(records, file_path)
+    columns = record_columns(records.dtype)
+
+    # Remove rows with abnormal values
+    valid_rows = valid_row_mask(records)
+    if not valid_rows.all():
+        print(f"Removed {(~valid_rows).sum()} rows with abnormal values.")
+
+    timestamp_columns = [(col, path) for col, path in columns if 'timestamp' in col]
+    start_index = find_valid_start_row(records, [path for _, path in timestamp_columns], valid_rows)
+    if start_index is None:
+        print(f"Warning: No valid timestamps less than 1 second found in {file_path}")
+        return None
+
+    # Rows are only materialised once the cheap masks have been applied
+    rows = np.flatnonzero(valid_rows)[start_index:]
+
+    for col, path in columns:
+        if 'index' not in col:
+            continue
+        keep = first_occurrence_mask(record_field(records, path)[rows])
+        if not keep.all():
+            print(f"Found {(~keep).sum()} duplicate index values in column {col}. Removing them.")
+            rows = rows[keep]
+
+    for col, path in timestamp_columns:
+        time_diff = np.diff(record_field(records, path)[rows])
+        large_gaps = (time_diff > 0.1).sum()
+        if large_gaps > 20:
+            print(f"Alert: {large_gaps} instances of timestamp differences exceeding 100ms in column {col}")
+
+    return records[rows]
+
+def records_to_dataframe(records):
+    return pd.DataFrame({col: record_field(records, path) for col, path in record_columns(records.dtype)})
+
+def process_binary_file(file_path, output_base_dir):
+    print(f"Processing file: {file_path}")
+
+    records = load_binary(file_path)
+    if len(records) == 0 or not records.dtype.names:
+        print(f"Skipping file with only headers: {file_path}")
+        return
+
+    cleaned = clean_records(records, file_path)
+    if cleaned is None:
+        return
+
+    date_str = extract_date_from_filename(os.path.splitext(os.path.basename(file_path))[0])
+    output_dir = os.path.join(output_base_dir, date_str)
+
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    # Downstream stages still read CSV, so write the cleaned output as before
+    output_path = os.path.join(output_dir, os.path.splitext(os.path.basename(file_path))[0] + '.csv')
+    records_to_dataframe(cleaned).to_csv(output_path, index=False)
+    print(f"Cleaned data saved to: {output_path}")
+
+def benchmark_ingestion(csv_path, binary_path, repeats=5):
+    def best_of(fn):
+        timings = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            fn()
+            timings.append(time.perf_counter() - start)
+        return min(timings)
+
+    def read_csv():
+        df = pd.read_csv(csv_path)
+        df.to_numpy().sum()
+
+    def read_binary():
+        records = load_binary(binary_path)
+        for _, path in record_columns(records.dtype):
+            record_field(records, path).sum()
+
+    csv_time = best_of(read_csv)
+    binary_time = best_of(read_binary)
+    size_mb = os.path.getsize(csv_path) / 1e6
+    print(f"{os.path.basename(csv_path)}")
+    print(f"  pd.read_csv:     {csv_time:.4f}s ({size_mb / csv_time:.1f} MB/s of CSV)")
+    print(f"  np.load (mmap):  {binary_time:.4f}s ({size_mb / binary_time:.1f} MB/s of CSV)")
+    print(f"  Speedup: {csv_time / binary_time:.1f}x")
+    return csv_time, binary_time
+
+def main():
+    parser = argparse.ArgumentParser(description="Clean sessions from memory-mapped binary records.")
+    parser.add_argument('--input-dir', default='data')
+    parser.add_argument('--binary-dir', default='binary_data')
+    parser.add_argument('--output-dir', default='cleaned_data')
+    parser.add_argument('--benchmark', action='store_true', help="Compare pd.read_csv against the binary records instead of cleaning")
+    args = parser.parse_args()
+
+    csv_paths = sorted(glob.glob(os.path.join(args.input_dir, '*.csv')))
+
+    if args.benchmark:
+        for file_path in csv_paths:
+            binary_path = convert_csv_to_binary(file_path, args.binary_dir)
+            if binary_path is not None:
+                benchmark_ingestion(file_path, binary_path)
+        return
+
+    if not os.path.exists(args.output_dir):
+        os.makedirs(args.output_dir)
+
+    # Only new or modified CSVs are parsed; the rest reuse their existing .npy.
+    # Driving the loop from input_dir keeps stale .npy files out of the output.
+    for file_path in csv_paths:
+        binary_path = convert_csv_to_binary(file_path, args.binary_dir)
+        if binary_path is not None:
+            process_binary_file(binary_path, args.output_dir)
+
+if __name__ == "__main__":
+    main()
@@ -32,22 +32,22 @@ def detect_peaks(data, window_size=20, sensitivity_factor=0.4, min_distance=5):
     
     return peak_indices
 
+# Select relevant columns (skip timestamp, index, and battery percentage)
+columns_to_extract = [
+    'right_leg_accel_x', 'right_leg_accel_y', 'right_leg_accel_z',
+    'left_leg_accel_x', 'left_leg_accel_y', 'left_leg_accel_z',
+]
+
+# columns_to_extract = [
+#     'right_leg_accel_x', 'right_leg_accel_y', 'right_leg_accel_z',
+#     'right_leg_gyro_x', 'right_leg_gyro_y', 'right_leg_gyro_z',
+#     'left_leg_accel_x', 'left_leg_accel_y', 'left_leg_accel_z',
+#     'left_leg_gyro_x', 'left_leg_gyro_y', 'left_leg_gyro_z'
+# ]
+
 def plot_and_save_segments(data, peaks, output_dir, csv_output_dir, filename):
     base_name = os.path.splitext(os.path.basename(filename))[0]
     
-    # Select relevant columns (skip timestamp, index, and battery percentage)
-    columns_to_extract = [
-        'right_leg_accel_x', 'right_leg_accel_y', 'right_leg_accel_z',
-        'left_leg_accel_x', 'left_leg_accel_y', 'left_leg_accel_z',
-    ]
-
-    # columns_to_extract = [
-    #     'right_leg_accel_x', 'right_leg_accel_y', 'right_leg_accel_z',
-    #     'right_leg_gyro_x', 'right_leg_gyro_y', 'right_leg_gyro_z',
-    #     'left_leg_accel_x', 'left_leg_accel_y', 'left_leg_accel_z',
-    #     'left_leg_gyro_x', 'left_leg_gyro_y', 'left_leg_gyro_z'
-    # ]
-
     data = data[columns_to_extract]
 
     for i in range(len(peaks) - 1):
@@ -77,6 +77,10 @@ def process_all_files(input_dir, output_dir, csv_output_dir):
         if filename.endswith(".csv"):
             filepath = os.path.join(input_dir, filename)
             df = pd.read_csv(filepath)
+            missing_columns = [col for col in columns_to_extract if col not in df.columns]
+            if missing_columns:
+                print(f"Skipping file without leg data {missing_columns}: {filepath}")
+                continue
 
             # Extract the right leg accel z data for peak detection
             x_accel_data = df['right_leg_accel_x'].values
@@ -93,10 +97,11 @@ def process_all_files(input_dir, output_dir, csv_output_dir):
             plt.savefig(os.path.join(output_dir, results_filename))
             plt.close()
 
-# Directories
-input_directory = "peak_detection/hopping"
-output_directory = "peak_detection/extracted_segments"
-csv_output_directory = "peak_detection/extracted_segments_csv"
+if __name__ == "__main__":
+    # Directories
+    input_directory = "peak_detection/hopping"
+    output_directory = "peak_detection/extracted_segments"
+    csv_output_directory = "peak_detection/extracted_segments_csv"
 
-# Process all files in the directory
-process_all_files(input_directory, output_directory, csv_output_directory)
+    # Process all files in the directory
+    process_all_files(input_directory, output_directory, csv_output_directory)
@@ -55,8 +55,9 @@ def extract_features_from_segments(directory, window_size=4, output_dir='peak_de
             features_df.to_csv(output_filename, index=False)
             print(f"Extracted features saved to {output_filename}")
 
-# Directory containing the extracted segments
-segments_directory = 'peak_detection/extracted_segments_csv'
+if __name__ == "__main__":
+    # Directory containing the extracted segments
+    segments_directory = 'peak_detection/extracted_segments_csv'
 
-# Extract features from all files in the directory
-extract_features_from_segments(segments_directory)
+    # Extract features from all files in the directory
+    extract_features_from_segments(segments_directory)
@@ -1,10 +1,12 @@
 import os
+import argparse
 import numpy as np
 import tensorflow as tf
 from sklearn.cluster import KMeans
 from sklearn.preprocessing import StandardScaler
 from sklearn.metrics import silhouette_score
 import pandas as pd
+from quantile_sketch import KLLSketch, save_sketches, load_sketches
 
 def load_feature_files(directory):
     data = []
@@ -21,11 +23,6 @@ def load_feature_files(directory):
                 file_info.append((filename, row_num))
     return np.array(data), file_info, file_count
 
-# Update the function call for training data
-feature_dir = "peak_detection/features_output"
-X_train, train_file_info, train_file_count = load_feature_files(feature_dir)
-print(f"Number of training files: {train_file_count}")
-
 def find_optimal_clusters(X, max_clusters=10):
     silhouette_scores = []
     for n_clusters in range(2, max_clusters + 1):
@@ -33,38 +30,31 @@ def find_optimal_clusters(X, max_clusters=10):
         cluster_labels = kmeans.fit_predict(X)
         silhouette_avg = silhouette_score(X, cluster_labels)
         silhouette_scores.append(silhouette_avg)
-    
+
     optimal_clusters = silhouette_scores.index(max(silhouette_scores)) + 2
     return optimal_clusters
 
-# Find optimal number of clusters
-optimal_clusters = find_optimal_clusters(X_train)
-print(f"Optimal number of clusters: {optimal_clusters}")
-
 class AnomalyDetector:
     def __init__(self, n_clusters):
         self.scaler = StandardScaler()
         self.kmeans = KMeans(n_clusters=n_clusters)
-    
+
     def fit(self, X):
         X_scaled = self.scaler.fit_transform(X)
         self.kmeans.fit(X_scaled)
-    
+
     def predict(self, X):
         X_scaled = self.scaler.transform(X)
         distances = self.kmeans.transform(X_scaled)
         return np.min(distances, axis=1)
 
-detector = AnomalyDetector(n_clusters=optimal_clusters)
-detector.fit(X_train)
-
 class TFAnomalyDetector(tf.Module):
     def __init__(self, kmeans, scaler):
         self.n_clusters = kmeans.n_clusters
         self.centroids = tf.Variable(kmeans.cluster_centers_, dtype=tf.float32)
         self.scaler_mean = tf.Variable(scaler.mean_, dtype=tf.float32)
         self.scaler_scale = tf.Variable(scaler.scale_, dtype=tf.float32)
-    
+
     # @tf.function(input_signature=[tf.TensorSpec(shape=[1, 84], dtype=tf.float32)])
     @tf.function(input_signature=[tf.TensorSpec(shape=[1, 42], dtype=tf.float32)])
     def __call__(self, x):
@@ -72,82 +62,157 @@ class TFAnomalyDetector(tf.Module):
         distances = tf.reduce_sum(tf.square(tf.expand_dims(x_scaled, axis=1) - self.centroids), axis=2)
         return tf.reduce_min(distances, axis=1)
 
-tf_detector = TFAnomalyDetector(detector.kmeans, detector.scaler)
-
-converter = tf.lite.TFLiteConverter.from_keras_model(tf_detector)
-tflite_model = converter.convert()
-
-with open('peak_detection/hopping_anomaly_detector.tflite', 'wb') as f:
-    f.write(tflite_model)
-
-interpreter = tf.lite.Interpreter(model_content=tflite_model)
-interpreter.allocate_tensors()
-
-def get_tflite_predictions(interpreter, X):
+def score_sample(interpreter, sample):
     input_details = interpreter.get_input_details()
     output_details = interpreter.get_output_details()
-    results = []
-    for sample in X:
-        # interpreter.set_tensor(input_details[0]['index'], sample.reshape(1, 84).astype(np.float32))
-        interpreter.set_tensor(input_details[0]['index'], sample.reshape(1, 42).astype(np.float32))
-        interpreter.invoke()
-        results.append(interpreter.get_tensor(output_details[0]['index'])[0])
-    return np.array(results)
+    # The input shape comes from the model ([1, 42], or [1, 84] with gyro features)
+    interpreter.set_tensor(input_details[0]['index'], sample.reshape(input_details[0]['shape']).astype(np.float32))
+    interpreter.invoke()
+    return interpreter.get_tensor(output_details[0]['index'])[0]
 
-tflite_train_results = get_tflite_predictions(interpreter, X_train)
-threshold = np.percentile(tflite_train_results, 70)
-print(f"\nAnomaly threshold (based on TFLite model): {threshold}")
-
-test_dir = "peak_detection/test_data"
-X_test, test_file_info, test_file_count = load_feature_files(test_dir)
-print(f"Number of test files: {test_file_count}")
-
-tflite_test_results = get_tflite_predictions(interpreter, X_test)
+def get_tflite_predictions(interpreter, X):
+    return np.array([score_sample(interpreter, sample) for sample in X])
+
+def exercise_from_feature_file(filename):
+    # features_<exercise>-<session>_segment_<start>_<end>.csv
+    name = filename[len("features_"):] if filename.startswith("features_") else filename
+    return name.split('-')[0]
+
+def score_into_sketches(interpreter, X, file_info, sketches=None):
+    # Streams each score into an overall sketch and one sketch per exercise,
+    # so thresholds can be read at any percentile without keeping the scores
+    if sketches is None:
+        sketches = {}
+    sketches.setdefault("all", KLLSketch())
+    for sample, (filename, _) in zip(X, file_info):
+        score = score_sample(interpreter, sample)
+        sketches["all"].update(score)
+        sketches.setdefault(exercise_from_feature_file(filename), KLLSketch()).update(score)
+    return sketches
+
+def train_model(feature_dir, model_path, sketches_path):
+    X_train, train_file_info, train_file_count = load_feature_files(feature_dir)
+    print(f"Number of training files: {train_file_count}")
+
+    # Find optimal number of clusters
+    optimal_clusters = find_optimal_clusters(X_train)
+    print(f"Optimal number of clusters: {optimal_clusters}")
+
+    detector = AnomalyDetector(n_clusters=optimal_clusters)
+    detector.fit(X_train)
+
+    tf_detector = TFAnomalyDetector(detector.kmeans, detector.scaler)
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(tf_detector)
+    tflite_model = converter.convert()
+
+    with open(model_path, 'wb') as f:
+        f.write(tflite_model)
+
+    interpreter = tf.lite.Interpreter(model_content=tflite_model)
+    interpreter.allocate_tensors()
+
+    train_sketches = score_into_sketches(interpreter, X_train, train_file_info)
+    save_sketches(train_sketches, sketches_path)
+    return interpreter, train_sketches
+
+def load_model(model_path, sketches_path):
+    print(f"Loading model from {model_path} and threshold sketches from {sketches_path}")
+    interpreter = tf.lite.Interpreter(model_path=model_path)
+    interpreter.allocate_tensors()
+    return interpreter, load_sketches(sketches_path)
+
+def saved_model_is_current(feature_dir, model_path, sketches_path):
+    # Same mtime rule as convert_csv_to_binary: the saved model is reused only
+    # if it is newer than every training feature file (and the directory
+    # itself, so deleted feature files also count as a change)
+    if not (os.path.exists(model_path) and os.path.exists(sketches_path)):
+        return False
+    saved_at = min(os.path.getmtime(model_path), os.path.getmtime(sketches_path))
+    feature_times = [os.path.getmtime(feature_dir)] + [
+        os.path.getmtime(os.path.join(feature_dir, filename))
+        for filename in os.listdir(feature_dir) if filename.endswith(".csv")
+    ]
+    return saved_at >= max(feature_times)
 
 def should_be_anomaly(filename):
     return "Stand on one leg" in filename or "Criss Cross" in filename
 
-print("\nTFLite Model Anomaly Detection:")
-correct_predictions = 0
-total_predictions = 0
-
-for (filename, row_num), result, anomaly_score in zip(test_file_info, tflite_test_results > threshold, tflite_test_results):
-    expected_anomaly = should_be_anomaly(filename)
-    is_correct = (result == expected_anomaly)
-    correct_predictions += int(is_correct)
-    total_predictions += 1
-    print(f"File: {filename}, Row: {row_num}, Is Anomaly: {result}, Anomaly Score: {anomaly_score}, Correct: {is_correct}")
-
-# Summary
-anomaly_counts = {}
-file_accuracies = {}
-
-for (filename, _), result in zip(test_file_info, tflite_test_results > threshold):
-    if filename not in anomaly_counts:
-        anomaly_counts[filename] = {"total": 0, "anomalies": 0, "correct": 0}
-    anomaly_counts[filename]["total"] += 1
-    if result:
-        anomaly_counts[filename]["anomalies"] += 1
-    if result == should_be_anomaly(filename):
-        anomaly_counts[filename]["correct"] += 1
-
-print("\nSummary:")
-overall_correct = 0
-overall_total = 0
-
-for filename, counts in anomaly_counts.items():
-    print(f"File: {filename}")
-    print(f"  Total rows: {counts['total']}")
-    print(f"  Anomalies detected: {counts['anomalies']}")
-    print(f"  Correct predictions: {counts['correct']}")
-    accuracy = (counts['correct'] / counts['total']) * 100
-    print(f"  Accuracy: {accuracy:.2f}%")
-    print()
-    
-    overall_correct += counts['correct']
-    overall_total += counts['total']
-
-overall_accuracy = (overall_correct / overall_total) * 100
-print(f"\nOverall Accuracy: {overall_accuracy:.2f}%")
-print(f"Total Correct Predictions: {overall_correct}")
-print(f"Total Predictions: {overall_total}")
\ No newline at end of file
+def evaluate(interpreter, threshold, test_dir):
+    X_test, test_file_info, test_file_count = load_feature_files(test_dir)
+    print(f"Number of test files: {test_file_count}")
+
+    tflite_test_results = get_tflite_predictions(interpreter, X_test)
+
+    print("\nTFLite Model Anomaly Detection:")
+    correct_predictions = 0
+    total_predictions = 0
+
+    for (filename, row_num), result, anomaly_score in zip(test_file_info, tflite_test_results > threshold, tflite_test_results):
+        expected_anomaly = should_be_anomaly(filename)
+        is_correct = (result == expected_anomaly)
+        correct_predictions += int(is_correct)
+        total_predictions += 1
+        print(f"File: {filename}, Row: {row_num}, Is Anomaly: {result}, Anomaly Score: {anomaly_score}, Correct: {is_correct}")
+
+    # Summary
+    anomaly_counts = {}
+
+    for (filename, _), result in zip(test_file_info, tflite_test_results > threshold):
+        if filename not in anomaly_counts:
+            anomaly_counts[filename] = {"total": 0, "anomalies": 0, "correct": 0}
+        anomaly_counts[filename]["total"] += 1
+        if result:
+            anomaly_counts[filename]["anomalies"] += 1
+        if result == should_be_anomaly(filename):
+            anomaly_counts[filename]["correct"] += 1
+
+    print("\nSummary:")
+    overall_correct = 0
+    overall_total = 0
+
+    for filename, counts in anomaly_counts.items():
+        print(f"File: {filename}")
+        print(f"  Total rows: {counts['total']}")
+        print(f"  Anomalies detected: {counts['anomalies']}")
+        print(f"  Correct predictions: {counts['correct']}")
+        accuracy = (counts['correct'] / counts['total']) * 100
+        print(f"  Accuracy: {accuracy:.2f}%")
+        print()
+
+        overall_correct += counts['correct']
+        overall_total += counts['total']
+
+    overall_accuracy = (overall_correct / overall_total) * 100
+    print(f"\nOverall Accuracy: {overall_accuracy:.2f}%")
+    print(f"Total Correct Predictions: {overall_correct}")
+    print(f"Total Predictions: {overall_total}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train the hopping anomaly detector and evaluate it on the test features.")
+    parser.add_argument('--percentile', type=float, default=70, help="Training score percentile used as the anomaly threshold")
+    parser.add_argument('--retrain', action='store_true', help="Retrain even if a saved model and sketches exist")
+    parser.add_argument('--feature-dir', default="peak_detection/features_output",
+                        help="Training features, e.g. the features_output/ of a sharded merge")
+    args = parser.parse_args()
+
+    feature_dir = args.feature_dir
+    test_dir = "peak_detection/test_data"
+    model_path = 'peak_detection/hopping_anomaly_detector.tflite'
+    sketches_path = 'peak_detection/hopping_anomaly_detector_sketches.json'
+
+    # Changing --percentile only needs the saved sketches, not a rescore of the training set
+    if not args.retrain and saved_model_is_current(feature_dir, model_path, sketches_path):
+        interpreter, train_sketches = load_model(model_path, sketches_path)
+    else:
+        if not args.retrain and os.path.exists(model_path):
+            print(f"Features in {feature_dir} are newer than {model_path}; retraining")
+        interpreter, train_sketches = train_model(feature_dir, model_path, sketches_path)
+
+    threshold = train_sketches["all"].percentile(args.percentile)
+    print(f"\nAnomaly threshold (based on TFLite model): {threshold}")
+    for exercise, sketch in train_sketches.items():
+        if exercise != "all":
+            print(f"  {exercise}: {sketch.percentile(args.percentile)} ({sketch.n} rows)")
+
+    evaluate(interpreter, threshold, test_dir)
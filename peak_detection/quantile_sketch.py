@@ -0,0 +1,116 @@
+import json
+import math
+import random
+
+class KLLSketch:
+    """Streaming quantile sketch (Karnin, Lang, Liberty 2016).
+
+    Keeps O(k log(n/k)) items instead of every score. Sketches built on
+    separate workers can be combined with merge().
+    """
+
+    def __init__(self, k=200, seed=None):
+        self.k = k
+        self.n = 0
+        self.compactors = []
+        self.size = 0
+        self.max_size = 0
+        self._rng = random.Random(seed)
+        self._grow()
+
+    def _grow(self):
+        self.compactors.append([])
+        self.max_size = sum(self._capacity(h) for h in range(len(self.compactors)))
+
+    def _capacity(self, height):
+        depth = len(self.compactors) - height - 1
+        return int(math.ceil(self.k * (2.0 / 3.0) ** depth)) + 1
+
+    def _compact(self, height):
+        items = sorted(self.compactors[height])
+        # Keep one item back on odd lengths so no weight is lost
+        leftover = [items.pop()] if len(items) % 2 == 1 else []
+        offset = 1 if self._rng.random() < 0.5 else 0
+        self.compactors[height] = leftover
+        return items[offset::2]
+
+    def _compress(self):
+        for height in range(len(self.compactors)):
+            if len(self.compactors[height]) >= self._capacity(height):
+                if height + 1 >= len(self.compactors):
+                    self._grow()
+                self.compactors[height + 1].extend(self._compact(height))
+                self.size = sum(len(c) for c in self.compactors)
+                if self.size < self.max_size:
+                    break
+
+    def update(self, value):
+        self.compactors[0].append(float(value))
+        self.size += 1
+        self.n += 1
+        if self.size >= self.max_size:
+            self._compress()
+
+    def extend(self, values):
+        for value in values:
+            self.update(value)
+
+    def merge(self, other):
+        if self.k != other.k:
+            raise ValueError(f"Cannot merge sketches with different k ({self.k} and {other.k})")
+        while len(self.compactors) < len(other.compactors):
+            self._grow()
+        for height, items in enumerate(other.compactors):
+            self.compactors[height].extend(items)
+        self.n += other.n
+        self.size = sum(len(c) for c in self.compactors)
+        while self.size >= self.max_size:
+            self._compress()
+        return self
+
+    def quantile(self, q):
+        if self.n == 0:
+            raise ValueError("Cannot query an empty sketch")
+        if len(self.compactors) == 1:
+            # Nothing has been compacted yet, so match np.percentile exactly
+            items = sorted(self.compactors[0])
+            position = q * (len(items) - 1)
+            lower = int(math.floor(position))
+            upper = min(lower + 1, len(items) - 1)
+            return items[lower] + (items[upper] - items[lower]) * (position - lower)
+        weighted = sorted(
+            (item, 2 ** height)
+            for height, items in enumerate(self.compactors)
+            for item in items
+        )
+        total = sum(weight for _, weight in weighted)
+        target = q * total
+        cumulative = 0
+        for item, weight in weighted:
+            cumulative += weight
+            if cumulative >= target:
+                return item
+        return weighted[-1][0]
+
+    def percentile(self, p):
+        return self.quantile(p / 100.0)
+
+    def to_dict(self):
+        return {"k": self.k, "n": self.n, "compactors": self.compactors}
+
+    @classmethod
+    def from_dict(cls, state):
+        sketch = cls(k=state["k"])
+        sketch.compactors = [list(items) for items in state["compactors"]]
+        sketch.n = state["n"]
+        sketch.size = sum(len(c) for c in sketch.compactors)
+        sketch.max_size = sum(sketch._capacity(h) for h in range(len(sketch.compactors)))
+        return sketch
+
+def save_sketches(sketches, path):
+    with open(path, 'w') as f:
+        json.dump({name: sketch.to_dict() for name, sketch in sketches.items()}, f)
+
+def load_sketches(path):
+    with open(path) as f:
+        return {name: KLLSketch.from_dict(state) for name, state in json.load(f).items()}
@@ -0,0 +1,202 @@
+import os
+import sys
+import glob
+import hashlib
+import shutil
+import argparse
+import importlib
+from multiprocessing import Pool
+
+import pandas as pd
+
+from cleaning_pipeline import process_file, extract_date_from_filename
+
+# The stage scripts live in peak_detection/ and are named with a numeric
+# prefix, so they are loaded through importlib rather than a plain import
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'peak_detection'))
+peak_detection = importlib.import_module('1_peak_detection')
+feature_extraction = importlib.import_module('2_feature_extraction')
+
+# Same subset the single-machine workflow copies into peak_detection/hopping
+hopping_exercises = [
+    "Hop forward on one leg (dominant)",
+    "Hop forward on one leg (non-dominant)",
+    "Hop 9 metres (dominant)",
+    "Hop 9 metres (non-dominant)",
+]
+
+def shard_key(file_path, shard_by):
+    file_name = os.path.basename(file_path)
+    if shard_by == 'date':
+        return extract_date_from_filename(file_name)
+    return file_name
+
+def shard_for_file(file_path, num_shards, shard_by='date'):
+    # md5 is stable across processes and machines, unlike hash()
+    digest = hashlib.md5(shard_key(file_path, shard_by).encode('utf-8')).hexdigest()
+    return int(digest, 16) % num_shards
+
+def files_for_shard(input_dir, shard_id, num_shards, shard_by='date'):
+    return [
+        file_path for file_path in sorted(glob.glob(os.path.join(input_dir, '*.csv')))
+        if shard_for_file(file_path, num_shards, shard_by) == shard_id
+    ]
+
+def exercise_from_file(file_path):
+    return os.path.splitext(os.path.basename(file_path))[0].split('-')[0]
+
+def score_feature_files(features_dir, model_path, sketches_path, percentile=70):
+    # Imported here so nodes that only extract features do not need TensorFlow
+    anomaly_detection = importlib.import_module('3_anomaly_detection')
+
+    interpreter, sketches = anomaly_detection.load_model(model_path, sketches_path)
+    threshold = sketches["all"].percentile(percentile)
+
+    summary = []
+    for filename in sorted(os.listdir(features_dir)):
+        if not filename.endswith('.csv'):
+            continue
+        features = pd.read_csv(os.path.join(features_dir, filename)).values
+        anomalies = 0
+        for sample in features:
+            if anomaly_detection.score_sample(interpreter, sample) > threshold:
+                anomalies += 1
+        summary.append({"file": filename, "total": len(features), "anomalies": anomalies})
+    return pd.DataFrame(summary, columns=["file", "total", "anomalies"])
+
+def run_shard(shard_id, num_shards, input_dir, work_dir, shard_by='date', model_path=None, sketches_path=None,
+              exercises=hopping_exercises, percentile=70):
+    node_dir = os.path.join(work_dir, f"node_{shard_id}")
+    cleaned_dir = os.path.join(node_dir, 'cleaned_data')
+    selected_dir = os.path.join(node_dir, 'hopping')
+    segments_dir = os.path.join(node_dir, 'extracted_segments')
+    segments_csv_dir = os.path.join(node_dir, 'extracted_segments_csv')
+    features_dir = os.path.join(node_dir, 'features_output')
+
+    # Start from an empty tree so outputs of an earlier run with a different
+    # shard layout are never picked up by the merge
+    if os.path.exists(node_dir):
+        shutil.rmtree(node_dir)
+    os.makedirs(cleaned_dir)
+    os.makedirs(selected_dir)
+
+    file_paths = files_for_shard(input_dir, shard_id, num_shards, shard_by)
+    print(f"Node {shard_id}: {len(file_paths)} files")
+
+    for file_path in file_paths:
+        process_file(file_path, cleaned_dir)
+
+    # Cleaned files are grouped by date directory; only the selected exercises
+    # go on to peak detection, as with peak_detection/hopping
+    for file_path in sorted(glob.glob(os.path.join(cleaned_dir, '*', '*.csv'))):
+        if exercise_from_file(file_path) in exercises:
+            shutil.copy(file_path, selected_dir)
+
+    peak_detection.process_all_files(selected_dir, segments_dir, segments_csv_dir)
+
+    if os.path.exists(segments_csv_dir):
+        feature_extraction.extract_features_from_segments(segments_csv_dir, output_dir=features_dir)
+
+    # Created even for an empty shard, so the merge can tell a node that ran
+    # from one that failed or was never copied back
+    if not os.path.exists(features_dir):
+        os.makedirs(features_dir)
+
+    if model_path and sketches_path:
+        summary = score_feature_files(features_dir, model_path, sketches_path, percentile)
+        summary.to_csv(os.path.join(node_dir, 'anomaly_summary.csv'), index=False)
+
+    return node_dir
+
+def clear_output_dir(output_dir, overwrite=False):
+    if os.path.exists(output_dir) and os.listdir(output_dir):
+        if not overwrite:
+            raise ValueError(f"Output directory {output_dir} is not empty; pass overwrite=True to replace it")
+        shutil.rmtree(output_dir)
+
+def check_node_outputs(node_dirs):
+    missing = [
+        node_dir for node_dir in node_dirs
+        if not os.path.isdir(os.path.join(node_dir, 'features_output'))
+    ]
+    if missing:
+        raise ValueError(f"Missing node output (no features_output/): {', '.join(missing)}")
+
+    scored = [os.path.exists(os.path.join(node_dir, 'anomaly_summary.csv')) for node_dir in node_dirs]
+    if any(scored) and not all(scored):
+        unscored = [node_dir for node_dir, has_summary in zip(node_dirs, scored) if not has_summary]
+        raise ValueError(f"Missing anomaly_summary.csv in: {', '.join(unscored)}")
+
+def merge_shards(node_dirs, output_dir, overwrite=False):
+    # A partial merge would look like a complete one, so refuse it outright
+    check_node_outputs(node_dirs)
+    clear_output_dir(output_dir, overwrite)
+
+    features_dir = os.path.join(output_dir, 'features_output')
+    os.makedirs(features_dir)
+
+    # Keep the per-file feature CSVs so 3_anomaly_detection can run on the merged tree
+    matrices = []
+    summaries = []
+    for node_dir in node_dirs:
+        for file_path in sorted(glob.glob(os.path.join(node_dir, 'features_output', '*.csv'))):
+            shutil.copy(file_path, features_dir)
+            df = pd.read_csv(file_path)
+            df.insert(0, 'file', os.path.basename(file_path))
+            matrices.append(df)
+        summary_path = os.path.join(node_dir, 'anomaly_summary.csv')
+        if os.path.exists(summary_path):
+            summaries.append(pd.read_csv(summary_path))
+
+    if matrices:
+        feature_matrix = pd.concat(matrices, ignore_index=True)
+        feature_matrix.to_csv(os.path.join(output_dir, 'feature_matrix.csv'), index=False)
+        print(f"Merged feature matrix: {feature_matrix.shape[0]} rows from {len(matrices)} files")
+
+    if summaries:
+        anomaly_summary = pd.concat(summaries, ignore_index=True).groupby('file', as_index=False).sum()
+        anomaly_summary.to_csv(os.path.join(output_dir, 'anomaly_summary.csv'), index=False)
+        total = anomaly_summary['total'].sum()
+        anomalies = anomaly_summary['anomalies'].sum()
+        print(f"Merged anomaly summary: {anomalies} anomalies in {total} rows")
+
+def run_local(num_shards, input_dir, work_dir, output_dir, shard_by='date', model_path=None, sketches_path=None,
+              exercises=hopping_exercises, overwrite=False, percentile=70):
+    # Stand-in for a multi-node run: one process per shard, each with its own tree
+    clear_output_dir(output_dir, overwrite)
+    args = [
+        (shard_id, num_shards, input_dir, work_dir, shard_by, model_path, sketches_path, exercises, percentile)
+        for shard_id in range(num_shards)
+    ]
+    with Pool(num_shards) as pool:
+        node_dirs = pool.starmap(run_shard, args)
+    merge_shards(node_dirs, output_dir, overwrite)
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the pipeline on one shard of the sessions, or merge shard outputs.")
+    parser.add_argument('--num-shards', type=int, required=True)
+    parser.add_argument('--shard-id', type=int, help="Run only this shard (one node). Omit to simulate all nodes locally.")
+    parser.add_argument('--shard-by', choices=['date', 'hash'], default='date')
+    parser.add_argument('--input-dir', default='data')
+    parser.add_argument('--work-dir', default='shards')
+    parser.add_argument('--output-dir', default='merged')
+    parser.add_argument('--model', help="TFLite model for per-node anomaly scoring")
+    parser.add_argument('--sketches', help="Threshold sketches saved alongside the model")
+    parser.add_argument('--percentile', type=float, default=70, help="Training score percentile used as the anomaly threshold")
+    parser.add_argument('--exercises', nargs='+', default=hopping_exercises, help="Exercises that go through peak detection")
+    parser.add_argument('--merge', action='store_true', help="Merge existing node outputs in --work-dir")
+    parser.add_argument('--overwrite', action='store_true', help="Replace a non-empty --output-dir when merging")
+    args = parser.parse_args()
+
+    if args.merge:
+        node_dirs = [os.path.join(args.work_dir, f"node_{shard_id}") for shard_id in range(args.num_shards)]
+        merge_shards(node_dirs, args.output_dir, args.overwrite)
+    elif args.shard_id is not None:
+        run_shard(args.shard_id, args.num_shards, args.input_dir, args.work_dir, args.shard_by, args.model, args.sketches,
+                  args.exercises, args.percentile)
+    else:
+        run_local(args.num_shards, args.input_dir, args.work_dir, args.output_dir, args.shard_by, args.model, args.sketches,
+                  args.exercises, args.overwrite, args.percentile)
+
+if __name__ == "__main__":
+    main()